@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
 from pathlib import Path
-from datetime import date
-import os, sys, glob, pandas as pd
-import gspread
-from gspread_dataframe import set_with_dataframe
+from datetime import date, datetime
+import os, sys, argparse, pandas as pd
+import numpy as np
 from dotenv import load_dotenv
 import re
-from csv import Sniffer
-from gspread.utils import rowcol_to_a1
+import json
+from functools import lru_cache
+from csv import Sniffer, reader as csv_reader
 
 BASE = Path(__file__).parent
 load_dotenv(BASE / ".env")
@@ -15,217 +15,38 @@ load_dotenv(BASE / ".env")
 SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 SERVICE_JSON = "service_account.json"
 TARGET_TAB = "Overdue aging"
-CSV_PATTERN = str(BASE / "incoming_csv" / "*.csv")
+CSV_DIR = BASE / "incoming_csv"
 MINIMUM_DAYS_OVERDUE = 21
+STATE_FILE = Path("~/.cache/qb-aging/state.json").expanduser()
+TOKEN_FILE = STATE_FILE.with_name("token.json")
 
-try:
-    csv_path = max(glob.glob(CSV_PATTERN), key=os.path.getmtime)
-except ValueError:
-    sys.exit("❌  No CSV found in incoming_csv/.  Aborting.")
-
-#
-# Read CSV ── Handle the specific structure with title row
-#
-def read_ar_aging_csv(csv_path):
-    """Read AR Aging CSV with title row structure"""
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    # Find the header row (contains "Date", "Due date", etc.)
-    header_row_idx = None
-    for i, line in enumerate(lines):
-        if 'Due date' in line and 'Customer full name' in line:
-            header_row_idx = i
-            break
-    
-    if header_row_idx is None:
-        sys.exit("❌  Could not find header row with 'Due date' and 'Customer full name'")
-    
-    print(f"🔎 Found headers at line {header_row_idx + 1}")
-    
-    # Join lines from header onwards
-    csv_content = ''.join(lines[header_row_idx:])
-    
-    # Detect delimiter
-    sniffer = Sniffer()
-    dialect = sniffer.sniff(csv_content[:1024], delimiters=",;\t")
-    delimiter = dialect.delimiter
-    
-    print(f"🔎 Detected delimiter: '{delimiter}'")
-    
-    # Read with pandas from the header line onwards
-    from io import StringIO
-    df = pd.read_csv(
-        StringIO(csv_content),
-        dtype=str,
-        delimiter=delimiter,
-        skip_blank_lines=True,
-        keep_default_na=False
-    )
-    
-    return df
-
-df = read_ar_aging_csv(csv_path)
-print(f"📊 Total rows in CSV: {len(df)}")
-print(f"📊 Original columns: {list(df.columns)}")
-
-# Clean column names
-df.columns = df.columns.str.strip().str.lower()
-df.columns = df.columns.str.replace("\u00A0", " ", regex=False)
-df.columns = df.columns.str.replace(r"\s+", " ", regex=True)
-
-print(f"📊 Cleaned columns: {list(df.columns)}")
+_CAMEL = re.compile(r"([a-z])([A-Z])")
+_WS = re.compile(r"\s+")
+_NBSP = str.maketrans({"\u00A0": " "})
+_AMOUNT_JUNK = str.maketrans("", "", ",$")  # thousands separators and currency signs
 
 # Updated column mapping for your specific CSV structure
+# Keys are normalized CSV headers, values the names used from there on
 ALT_NAMES = {
     # Balance synonyms - use "open balance" as it's the current amount owed
-    "open balance": "balance",
-    "amount": "balance",  # fallback
-    "balance": "balance",
+    "open balance": "Balance",
+    "amount": "Balance",  # fallback
+    "balance": "Balance",
     
     # Due date synonyms
-    "due date": "due date",
-    "duedate": "due date",
-    "invoice due date": "due date",
+    "due date": "Due Date",
+    "duedate": "Due Date",
+    "invoice due date": "Due Date",
     
     # Invoice date synonyms
-    "invoice date": "invoice date", 
-    "date": "invoice date",  # This is transaction/invoice date, not due date
+    "invoice date": "Invoice Date", 
+    "date": "Invoice Date",  # This is transaction/invoice date, not due date
     
     # Customer synonyms
-    "customer full name": "customer",
-    "customer name": "customer",
-    "customer": "customer",
-}
-
-df.rename(columns=ALT_NAMES, inplace=True)
-print(f"📊 Columns after mapping: {list(df.columns)}")
-
-# Remove duplicate columns
-if df.columns.duplicated().any():
-    df = df.loc[:, ~df.columns.duplicated(keep="last")]
-
-# Drop subtotal/rubric rows such as "OUT OF RANGE"
-before_drop = len(df)
-# Check multiple possible columns for OUT OF RANGE
-for col in df.columns:
-    if df[col].astype(str).str.contains("OUT OF RANGE", na=False).any():
-        df = df[~df[col].astype(str).str.contains("OUT OF RANGE", na=False)]
-        break
-
-print(f"📊 Dropped {before_drop - len(df)} 'OUT OF RANGE' rows, {len(df)} remaining")
-
-# Standardize final column names for processing
-df.rename(columns={"due date": "Due Date", "balance": "Balance"}, inplace=True)
-print(f"📊 Final columns: {list(df.columns)}")
-
-# Verify required columns exist
-for col in ("Due Date", "Balance"):
-    if col not in df.columns:
-        print(f"❌  Available columns: {list(df.columns)}")
-        sys.exit(f"❌  CSV missing '{col}' column after mapping.")
-
-# Process dates and amounts
-df["Due Date"] = pd.to_datetime(df["Due Date"], format='%m/%d/%Y', errors="coerce")
-df["Balance_raw"] = df["Balance"]
-df["Balance"] = pd.to_numeric(df["Balance"].str.replace(',', ''), errors="coerce")
-df["Days Overdue"] = (pd.Timestamp(date.today()) - df["Due Date"]).dt.days
-
-# Debug: Check for data conversion issues
-print(f"📊 Rows with valid Due Date: {df['Due Date'].notna().sum()}")
-print(f"📊 Rows with valid Balance: {df['Balance'].notna().sum()}")
-print(f"📊 Rows with Balance > 0: {(df['Balance'] > 0).sum()}")
-
-# Check for balance conversion issues
-balance_conversion_failed = df[df["Balance"].isna() & df["Balance_raw"].notna()]
-if len(balance_conversion_failed) > 0:
-    print(f"⚠️  {len(balance_conversion_failed)} rows failed balance conversion")
-    print("   Sample raw balance values:", balance_conversion_failed["Balance_raw"].head().tolist())
-
-# Filter based on minimum days overdue threshold
-print(f"\n🔧 Processing only invoices {MINIMUM_DAYS_OVERDUE}+ days overdue")
-overdue = df.query(f"Balance > 0 and `Days Overdue` >= {MINIMUM_DAYS_OVERDUE}", engine="python").copy()
-
-print(f"📊 Final rows to process: {len(overdue)}")
-
-# Show distribution for debugging
-print("\n📊 Days Overdue distribution (for Balance > 0):")
-positive_balance = df[df["Balance"] > 0]
-if len(positive_balance) > 0:
-    print(f"  - Less than 21 days: {(positive_balance['Days Overdue'] < 21).sum()}")
-    print(f"  - 21+ days: {(positive_balance['Days Overdue'] >= 21).sum()}")
-    print(f"  - Invalid/NaT dates: {positive_balance['Days Overdue'].isna().sum()}")
-
-if len(overdue) == 0:
-    print("⚠️  No overdue records found. Exiting.")
-    sys.exit(0)
-
-# ─────────────────────────────────────────────────────────────────────────────
-# 🔧  Normalize column names BEFORE aggregation
-# ─────────────────────────────────────────────────────────────────────────────
-rename_map_pre = {
-    "Balance": "Amount",
-    "Due Date": "Date", 
-    "Days Overdue": "Days Outstanding",
-    "customer": "Customer",
-    "customer name": "Customer",
     "customer full name": "Customer",
+    "customer name": "Customer",
+    "customer": "Customer",
 }
-overdue.rename(columns=rename_map_pre, inplace=True)
-
-# Clean up customer names
-if "Customer" in overdue.columns:
-    overdue["Customer"] = overdue["Customer"].str.split(":").str[0]
-    overdue["Customer"] = overdue["Customer"].str.replace(r"([a-z])([A-Z])", r"\1 \2", regex=True)
-    overdue["Customer"] = overdue["Customer"].str.strip()
-else:
-    # Fallback: find any column containing 'customer'
-    fallback_cols = [c for c in overdue.columns if "customer" in c.lower()]
-    if fallback_cols:
-        overdue.rename(columns={fallback_cols[0]: "Customer"}, inplace=True)
-        print(f"⚠️  Using fallback column '{fallback_cols[0]}' as 'Customer'")
-        overdue["Customer"] = overdue["Customer"].str.split(":").str[0]
-        overdue["Customer"] = overdue["Customer"].str.replace(r"([a-z])([A-Z])", r"\1 \2", regex=True)
-        overdue["Customer"] = overdue["Customer"].str.strip()
-    else:
-        raise KeyError(f"❌  Could not locate a customer column. Available columns: {list(overdue.columns)}")
-
-print(f"📊 Columns before aggregation: {list(overdue.columns)}")
-
-# ─────────────────────────────────────────────────────────────────────────────
-# 🔄  Aggregate multiple invoices per Customer
-# ─────────────────────────────────────────────────────────────────────────────
-agg_cols = {
-    "Amount": "sum",
-    "Date": "min",  # oldest outstanding invoice
-}
-overdue = (
-    overdue
-    .groupby("Customer", as_index=False)
-    .agg(agg_cols)
-    .copy()
-)
-
-# Recompute Days Outstanding using the oldest Date
-overdue["Date"] = pd.to_datetime(overdue["Date"], errors="coerce")
-overdue["Days Outstanding"] = (pd.Timestamp(date.today()) - overdue["Date"]).dt.days
-
-print(f"📊 Aggregated to unique customers: {len(overdue)} rows")
-
-# Collections workflow buckets (21+ days only)
-bins = [20, 30, 45, 60, 90, float("inf")]
-labels = ["21-30", "31-45", "46-60", "61-90", "91+"]
-
-overdue["Bucket"] = pd.cut(overdue["Days Outstanding"], bins, labels=labels)
-
-bucket_to_collection = {
-    "21-30": "Accounting Outreach",
-    "31-45": "CSM/AE Outreach", 
-    "46-60": "Manager Escalation",
-    "61-90": "Add to No Work List",
-    "91+": "Demand Letter",
-}
-overdue["Collection Item"] = overdue["Bucket"].astype(str).map(bucket_to_collection)
 
 # Constants
 HEADERS = [
@@ -245,40 +66,176 @@ HEADERS = [
 START_COL = 2   # column B
 HEADER_ROW = 3  # header appears in row 3
 MAX_ROWS = 2000
+SHEETS_EPOCH = np.datetime64("1899-12-30", "D")  # day 0 of Sheets date serials
+FORMAT_VERSION = 1  # bump when setup_formatting_with_api changes, to re-apply it once
+CURRENCY_FORMAT = {"type": "CURRENCY", "pattern": "$#,##0.00"}
+DATE_FORMAT = {"type": "DATE", "pattern": "yyyy-mm-dd"}
+# Number format sent with each synced cell, so Amount and the Date serials render
+# correctly even where the column formatting is missing (outside MAX_ROWS, or failed)
+CELL_FORMATS = [{"Amount": CURRENCY_FORMAT, "Date": DATE_FORMAT}.get(h) for h in HEADERS]
+CELL_FIELDS = "userEnteredValue,userEnteredFormat.numberFormat"
+
+def newest_csv():
+    """Path of the most recently modified CSV in CSV_DIR, or None"""
+    best, best_mtime = None, None
+    try:
+        with os.scandir(CSV_DIR) as entries:
+            for entry in entries:
+                # Case-insensitive like glob on Windows, where the task runs
+                if entry.name.lower().endswith(".csv") and entry.is_file():
+                    mtime = entry.stat().st_mtime
+                    if best_mtime is None or mtime > best_mtime:
+                        best, best_mtime = entry.path, mtime
+    except FileNotFoundError:
+        pass
+    return best
 
-# Ensure all expected columns exist
-for col in HEADERS:
-    if col not in overdue.columns:
-        overdue[col] = None
-
-# Format the Date column
-if "Date" in overdue.columns and not overdue.empty:
-    overdue["Date"] = pd.to_datetime(overdue["Date"], errors='coerce').dt.strftime('%Y-%m-%d')
-    print(f"📊 Formatted dates - sample: {overdue['Date'].head(5).tolist()}")
-
-# Re-order columns to match the Google Sheet
-overdue = overdue[HEADERS]
-
-# Connect to Google Sheets
-gc = gspread.service_account(filename=BASE / SERVICE_JSON)
-sh = gc.open_by_key(SHEET_ID)
-
-# Get or create worksheet
-try:
-    ws = sh.worksheet(TARGET_TAB)
-    worksheet_created = False
-except gspread.WorksheetNotFound:
-    ws = sh.add_worksheet(
-        title=TARGET_TAB,
-        rows=MAX_ROWS,
-        cols=len(HEADERS) + START_COL + 5
-    )
-    worksheet_created = True
+#
+# Read CSV ── Handle the specific structure with title row
+#
+def read_ar_aging_csv(csv_path):
+    """Read AR Aging CSV with title row structure"""
+    # Find the header row (contains "Date", "Due date", etc.) without loading the file
+    header_row_idx = None
+    with open(csv_path, 'rb') as f:
+        offset = 0
+        for i, raw in enumerate(f):
+            if b'Due date' in raw and b'Customer full name' in raw:
+                header_row_idx = i
+                probe = raw + f.read(1024)
+                break
+            offset += len(raw)
+    
+    if header_row_idx is None:
+        sys.exit("❌  Could not find header row with 'Due date' and 'Customer full name'")
+    
+    print(f"🔎 Found headers at line {header_row_idx + 1}")
+    
+    # Detect delimiter from the header line and the rows right after it
+    sniffer = Sniffer()
+    dialect = sniffer.sniff(probe.decode('utf-8', 'ignore')[:1024], delimiters=",;\t")
+    delimiter = dialect.delimiter
+    
+    print(f"🔎 Detected delimiter: '{delimiter}'")
+    
+    # Only materialize columns that are mapped later on. Select them by position: the
+    # sniffed dialect may strip separator spaces that the parsers keep in the raw names
+    header = next(csv_reader([raw.decode('utf-8-sig').rstrip("\r\n")], dialect))
+    keep = [i for i, c in enumerate(header) if is_wanted_column(c)]
+    
+    # Read straight from the header line onwards, every field as the exact source text
+    with open(csv_path, 'rb') as f:
+        f.seek(offset)
+        try:
+            # Multithreaded Arrow parser when pyarrow is installed
+            df = _read_with_pyarrow(f, delimiter, len(header), keep)
+        except (ImportError, pd.errors.ParserError):
+            f.seek(offset)
+            # No usecols here: with it the C parser silently shifts a row that has an
+            # extra field (an unquoted comma) instead of raising
+            df = pd.read_csv(
+                f,
+                engine="c",
+                encoding='utf-8',
+                dtype=str,
+                delimiter=delimiter,
+                skip_blank_lines=True,
+                na_filter=False,  # every field stays a string; no NA sentinel scan
+            ).iloc[:, keep]
+    df.columns = [header[i] for i in keep]
+    
+    return df
 
-def setup_formatting_with_api(spreadsheet, worksheet):
-    """Setup dropdowns and checkboxes using Sheets API directly"""
+def _read_with_pyarrow(f, delimiter, n_cols, keep):
+    """Columns `keep` (positions) of a CSV read with pyarrow, typed as strings from the start"""
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
     
-    sheet_id = worksheet.id
+    # pandas' pyarrow engine infers types before applying dtype=str ("0042" -> "42",
+    # "300.00" -> "300.0"), so call pyarrow directly with string column types
+    positions = [f"c{i}" for i in keep]
+    try:
+        table = pa_csv.read_csv(
+            f,
+            read_options=pa_csv.ReadOptions(column_names=[f"c{i}" for i in range(n_cols)], skip_rows=1),
+            parse_options=pa_csv.ParseOptions(
+                delimiter=delimiter, newlines_in_values=True, invalid_row_handler=_skip_footer,
+            ),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=positions, column_types=dict.fromkeys(positions, pa.string()),
+            ),
+        )
+    except pa.ArrowInvalid as e:
+        raise pd.errors.ParserError(e) from e
+    return table.to_pandas()
+
+def _skip_footer(row):
+    """pyarrow bad-row handler: drop the one-field timestamp footer, fail on anything else"""
+    return "skip" if row.actual_columns == 1 else "error"
+
+def normalize_column_name(name):
+    """Lower-case a CSV header and collapse NBSPs/runs of whitespace to one space"""
+    return _WS.sub(" ", name.translate(_NBSP)).strip().lower()
+
+def is_wanted_column(name):
+    """True for headers the pipeline maps (or may fall back to for the customer)"""
+    norm = normalize_column_name(name)
+    return norm in ALT_NAMES or "customer" in norm
+
+def clean_customer(s):
+    """Strip the QuickBooks sub-customer suffix and split camelCase names"""
+    return s.str.split(":", n=1).str[0].str.replace(_CAMEL, r"\1 \2", regex=True).str.strip()
+
+def _cell(v, number_format=None):
+    """CellData for one value; numbers are sent typed so Sheets doesn't re-parse them"""
+    if v is None or v != v:  # NaN is the only value not equal to itself
+        return {}
+    if isinstance(v, (int, float)):
+        cell = {"userEnteredValue": {"numberValue": v}}
+    else:
+        cell = {"userEnteredValue": {"stringValue": str(v)}}
+    if number_format:
+        cell["userEnteredFormat"] = {"numberFormat": number_format}
+    return cell
+
+def _one_of(vals):
+    """ONE_OF_LIST validation condition for a dropdown"""
+    return {"type": "ONE_OF_LIST", "values": [{"userEnteredValue": v} for v in vals]}
+
+def _dv(sheet_id, col_index, condition):
+    """setDataValidation request covering the data rows of one column"""
+    return {
+        "setDataValidation": {
+            "range": {
+                "sheetId": sheet_id,
+                "startRowIndex": HEADER_ROW,  # Row 4 (0-based)
+                "endRowIndex": MAX_ROWS,
+                "startColumnIndex": col_index,
+                "endColumnIndex": col_index + 1
+            },
+            "rule": {
+                "condition": condition,
+                "showCustomUi": True
+            }
+        }
+    }
+
+def _header_request(sheet_id):
+    """updateCells request writing HEADERS into the header row"""
+    return {
+        "updateCells": {
+            "rows": [{"values": [{"userEnteredValue": {"stringValue": h}} for h in HEADERS]}],
+            "fields": "userEnteredValue",
+            "start": {
+                "sheetId": sheet_id,
+                "rowIndex": HEADER_ROW - 1,  # Convert to 0-based
+                "columnIndex": START_COL - 1
+            }
+        }
+    }
+
+def formatting_requests(sheet_id):
+    """batchUpdate requests for the dropdowns, checkboxes and number formats"""
     
     # Prepare batch update requests
     requests = []
@@ -286,25 +243,10 @@ def setup_formatting_with_api(spreadsheet, worksheet):
     # 1. Add checkboxes for columns: Slack Updated (7), No Work List (8), Demand Letter (10)
     checkbox_columns = [7, 8, 10]  # 0-based offsets from START_COL
     
+    checkbox = {"type": "BOOLEAN"}
     for offset in checkbox_columns:
         col_index = START_COL + offset - 1  # Convert to 0-based index
-        requests.append({
-            "setDataValidation": {
-                "range": {
-                    "sheetId": sheet_id,
-                    "startRowIndex": HEADER_ROW,  # Row 4 (0-based)
-                    "endRowIndex": MAX_ROWS,
-                    "startColumnIndex": col_index,
-                    "endColumnIndex": col_index + 1
-                },
-                "rule": {
-                    "condition": {
-                        "type": "BOOLEAN"
-                    },
-                    "showCustomUi": True
-                }
-            }
-        })
+        requests.append(_dv(sheet_id, col_index, checkbox))
     
     # 2. Add dropdown for Action Taken (column 6)
     action_col_index = START_COL + 6 - 1  # Convert to 0-based
@@ -317,47 +259,13 @@ def setup_formatting_with_api(spreadsheet, worksheet):
         "Accounting Email Sent"
     ]
 
-    requests.append({
-        "setDataValidation": {
-            "range": {
-                "sheetId": sheet_id,
-                "startRowIndex": HEADER_ROW,
-                "endRowIndex": MAX_ROWS,
-                "startColumnIndex": action_col_index,
-                "endColumnIndex": action_col_index + 1
-            },
-            "rule": {
-                "condition": {
-                    "type": "ONE_OF_LIST",
-                    "values": [{"userEnteredValue": action} for action in actions]
-                },
-                "showCustomUi": True
-            }
-        }
-    })
+    requests.append(_dv(sheet_id, action_col_index, _one_of(actions)))
 
     # 3. Add dropdown for Removed from No Work List Approver (column 10)
     approver_col_index = START_COL + 9 - 1
     approvers = ["Julie Harris", "Ben Terrill", "Esau Quiroz"]
 
-    requests.append({
-        "setDataValidation": {
-            "range": {
-                "sheetId": sheet_id,
-                "startRowIndex": HEADER_ROW,
-                "endRowIndex": MAX_ROWS,
-                "startColumnIndex": approver_col_index,
-                "endColumnIndex": approver_col_index + 1
-            },
-            "rule": {
-                "condition": {
-                    "type": "ONE_OF_LIST",
-                    "values": [{"userEnteredValue": approver} for approver in approvers]
-                },
-                "showCustomUi": True
-            }
-        }
-    })
+    requests.append(_dv(sheet_id, approver_col_index, _one_of(approvers)))
 
     # 4. Format Amount column as currency
     amt_col_index = START_COL + 1 - 1  # Convert to 0-based
@@ -372,10 +280,7 @@ def setup_formatting_with_api(spreadsheet, worksheet):
             },
             "cell": {
                 "userEnteredFormat": {
-                    "numberFormat": {
-                        "type": "CURRENCY",
-                        "pattern": "$#,##0.00"
-                    }
+                    "numberFormat": CURRENCY_FORMAT
                 }
             },
             "fields": "userEnteredFormat.numberFormat"
@@ -395,74 +300,411 @@ def setup_formatting_with_api(spreadsheet, worksheet):
             },
             "cell": {
                 "userEnteredFormat": {
-                    "numberFormat": {
-                        "type": "DATE",
-                        "pattern": "yyyy-mm-dd"
-                    }
+                    "numberFormat": DATE_FORMAT
                 }
             },
             "fields": "userEnteredFormat.numberFormat"
         }
     })
     
+    return requests
+
+def setup_formatting_with_api(spreadsheet, worksheet):
+    """Setup dropdowns and checkboxes using Sheets API directly; returns whether it worked"""
+    requests = formatting_requests(worksheet.id)
+
     # Execute batch update
-    if requests:
-        try:
-            spreadsheet.batch_update({"requests": requests})
-            print("✅ Formatting applied successfully (dropdowns, checkboxes, number formats)")
-        except Exception as e:
-            print(f"⚠️  Error applying formatting: {e}")
-
-# Check if headers exist
-try:
-    header_present = bool(ws.cell(HEADER_ROW, START_COL).value)
-except gspread.exceptions.APIError:
-    header_present = False
-
-# Write headers if needed
-if not header_present:
-    ws.update(rowcol_to_a1(HEADER_ROW, START_COL), [HEADERS])
-    setup_formatting_with_api(sh, ws)
-
-# ─────────────────────────────────────────────────────────────────────────────
-# 🔄  Incremental update: update existing customers; append new ones
-# ─────────────────────────────────────────────────────────────────────────────
-existing_customers = ws.col_values(START_COL)  # Column B
-existing_customers = existing_customers[HEADER_ROW:]
-customer_to_row = {
-    name.strip(): idx
-    for idx, name in enumerate(existing_customers, start=HEADER_ROW + 1)
-    if name.strip()
-}
+    try:
+        spreadsheet.batch_update({"requests": requests})
+        print("✅ Formatting applied successfully (dropdowns, checkboxes, number formats)")
+        return True
+    except Exception as e:
+        print(f"⚠️  Error applying formatting: {e}")
+        return False
+
+@lru_cache(maxsize=1)
+def _credentials(mtime):
+    """Parsed service-account key; the file's mtime in the key picks up a replaced file"""
+    # gspread and google-auth load slowly; only import them once the sheet is needed
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    return Credentials.from_service_account_file(
+        BASE / SERVICE_JSON, scopes=gspread.auth.DEFAULT_SCOPES
+    )
 
-new_rows = []
+def get_client():
+    """gspread client that reuses the cached access token until it expires"""
+    import gspread
+    from google.auth.transport.requests import Request
+
+    creds = _credentials(os.path.getmtime(BASE / SERVICE_JSON))
+    if not creds.valid:
+        try:
+            cached = json.loads(TOKEN_FILE.read_text())
+            if cached["account"] == creds.service_account_email:
+                creds.token = cached["token"]
+                creds.expiry = datetime.fromisoformat(cached["expiry"])  # naive UTC
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # valid is False once within google-auth's refresh threshold of the expiry
+    if not creds.valid:
+        creds.refresh(Request())
+        try:
+            TOKEN_FILE.parent.mkdir(parents=True, exist_ok=True)
+            # Create the file owner-only so the bearer token is never world-readable
+            fd = os.open(TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            if hasattr(os, "fchmod"):  # a file left by an older run keeps its mode otherwise
+                os.fchmod(fd, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump({
+                    "account": creds.service_account_email,
+                    "token": creds.token,
+                    "expiry": creds.expiry.isoformat(),
+                }, f)
+        except OSError as e:
+            print(f"⚠️  Could not cache access token: {e}")
+
+    return gspread.authorize(creds)
+
+def open_spreadsheet():
+    """Authenticate and open the target spreadsheet"""
+    return get_client().open_by_key(SHEET_ID)
+
+def open_worksheet(sh):
+    """Return (worksheet, created)"""
+    import gspread
+
+    # Always looked up by title: reads address the tab by title and writes by sheetId,
+    # so a cached id could point the writes at a renamed (archived) tab
+    try:
+        return sh.worksheet(TARGET_TAB), False
+    except gspread.WorksheetNotFound:
+        ws = sh.add_worksheet(
+            title=TARGET_TAB,
+            rows=MAX_ROWS,
+            cols=len(HEADERS) + START_COL + 5
+        )
+        return ws, True
+
+def sync_worksheet(sh, ws, overdue):
+    """Write overdue rows; returns (header was already there, formatting applied here)"""
+    from gspread.exceptions import APIError
+    from gspread.utils import rowcol_to_a1, absolute_range_name
+
+    # Fetch the header cell and the existing customer column in one round trip
+    start_col_letter = rowcol_to_a1(1, START_COL)[:-1]
+    header_range, customer_range = sh.values_batch_get(
+        ranges=[
+            absolute_range_name(ws.title, rowcol_to_a1(HEADER_ROW, START_COL)),
+            absolute_range_name(ws.title, f"{rowcol_to_a1(HEADER_ROW + 1, START_COL)}:{start_col_letter}"),
+        ],
+        # Raw cell values; the server skips number formatting for the response
+        params={"valueRenderOption": "UNFORMATTED_VALUE"},
+    )["valueRanges"]
+
+    header_values = header_range.get("values", [])
+    header_present = bool(header_values and header_values[0] and header_values[0][0])
+
+    # ─────────────────────────────────────────────────────────────────────────────
+    # 🔄  Incremental update: update existing customers; append new ones
+    # ─────────────────────────────────────────────────────────────────────────────
+    existing_customers = [  # Column B, blank rows come back as []
+        row[0] if row else "" for row in customer_range.get("values", [])
+    ]
+    # Unformatted values keep a purely numeric name as a number, compare it as text
+    names = pd.Series(existing_customers, dtype=object).astype(str).str.strip()
+    has_name = names.astype(bool).to_numpy()
+    sheet_rows = np.arange(HEADER_ROW + 1, HEADER_ROW + 1 + len(names))
+    row_of = pd.Series(sheet_rows[has_name], index=names[has_name].to_numpy())
+    row_of = row_of[~row_of.index.duplicated(keep="last")]  # a repeated name maps to its last row
+
+    # Split into rows already on the sheet and new customers in one lookup
+    sheet_row = overdue["Customer"].map(row_of)
+    is_update = sheet_row.notna().to_numpy()
+    to_update = overdue[is_update]
+    to_append = overdue[~is_update]
+
+    # Update columns B‑G (Customer .. Collection Item) of existing customers
+    requests = [
+        {
+            "updateCells": {
+                "rows": [{"values": [_cell(v, fmt) for v, fmt in zip(row[:6], CELL_FORMATS)]}],
+                "fields": CELL_FIELDS,
+                "start": {
+                    "sheetId": ws.id,
+                    "rowIndex": r - 1,  # Convert to 0-based
+                    "columnIndex": START_COL - 1
+                }
+            }
+        }
+        for r, row in zip(
+            sheet_row[is_update].astype("int64").tolist(),
+            to_update.itertuples(index=False, name=None),
+        )
+    ]
 
-for _, r in overdue.iterrows():
-    cust = r["Customer"]
-    # Sanitize NaNs for Sheets API
-    row_values = [
-        ("" if pd.isna(r[h]) else r[h]) for h in HEADERS
+    # appendCells always starts at column A, so pad up to START_COL
+    new_rows = [
+        {"values": [{}] * (START_COL - 1) + [_cell(v, fmt) for v, fmt in zip(row, CELL_FORMATS)]}
+        for row in to_append.itertuples(index=False, name=None)
     ]
 
-    if cust in customer_to_row:
-        # Update columns B‑G (Customer .. Collection Item)
-        sheet_row = customer_to_row[cust]
-        start_cell = rowcol_to_a1(sheet_row, START_COL)
-        end_cell = rowcol_to_a1(sheet_row, START_COL + 5)
-        ws.update(f"{start_cell}:{end_cell}", [row_values[:6]])
-        print(f"🔄 Updated existing customer '{cust}' at row {sheet_row}")
+    if new_rows:
+        requests.append({
+            "appendCells": {
+                "sheetId": ws.id,
+                "rows": new_rows,
+                "fields": CELL_FIELDS
+            }
+        })
+
+    # A missing header (new or cleared worksheet) is written along with the data
+    if not header_present:
+        requests = [_header_request(ws.id)] + requests
+
+    # Updates and appends go out as one spreadsheets.batchUpdate. The first run tries
+    # to fit the formatting in too; it is best-effort, so if that batch is rejected
+    # the data is sent again on its own.
+    formatted = False
+    if not header_present:
+        try:
+            sh.batch_update({"requests": requests + formatting_requests(ws.id)})
+            formatted = True
+            print("✅ Formatting applied successfully (dropdowns, checkboxes, number formats)")
+        except APIError as e:
+            print(f"⚠️  Error applying formatting, sending the data without it: {e}")
+            sh.batch_update({"requests": requests})
+        print("✅ Headers written")
+    elif requests:
+        sh.batch_update({"requests": requests})
+
+    if len(to_update):
+        print(f"🔄 Updated {len(to_update)} existing customers")
+    if new_rows:
+        print(f"➕ Added {len(new_rows)} new customers")
+
+    print("✅ Sheet synchronised with latest CSV data")
+    return header_present, formatted
+
+def clean_overdue(df):
+    """Overdue customers from a raw AR aging frame, one row per customer in HEADERS order"""
+    print(f"📊 Total rows in CSV: {len(df)}")
+    print(f"📊 Original columns: {list(df.columns)}")
+
+    # Clean and map column names in one pass
+    df.columns = [ALT_NAMES.get(n, n) for n in map(normalize_column_name, df.columns)]
+    print(f"📊 Columns after mapping: {list(df.columns)}")
+
+    # Remove duplicate columns
+    if df.columns.has_duplicates:
+        df = df.loc[:, ~df.columns.duplicated(keep="last")]
+
+    # Drop subtotal/rubric rows such as "OUT OF RANGE"
+    before_drop = len(df)
+    # Check every text column for OUT OF RANGE in a single mask
+    obj = df.select_dtypes(include="object")
+    mask = obj.apply(lambda s: s.str.contains("OUT OF RANGE", na=False, regex=False)).any(axis=1)
+    df = df.loc[~mask]
+
+    print(f"📊 Dropped {before_drop - len(df)} 'OUT OF RANGE' rows, {len(df)} remaining")
+
+    print(f"📊 Final columns: {list(df.columns)}")
+
+    # Verify required columns exist
+    for col in ("Due Date", "Balance"):
+        if col not in df.columns:
+            print(f"❌  Available columns: {list(df.columns)}")
+            sys.exit(f"❌  CSV missing '{col}' column after mapping.")
+
+    # Locate the customer column; fall back to any column containing 'customer'
+    if "Customer" in df.columns:
+        customer_col = "Customer"
     else:
-        new_rows.append(row_values)
+        fallback_cols = [c for c in df.columns if "customer" in c.lower()]
+        if not fallback_cols:
+            raise KeyError(f"❌  Could not locate a customer column. Available columns: {list(df.columns)}")
+        customer_col = fallback_cols[0]
+        print(f"⚠️  Using fallback column '{customer_col}' as 'Customer'")
+
+    # Rows without a balance (blank lines, section headers) can't be overdue;
+    # drop them before the date and amount conversions
+    has_balance = df["Balance"].str.strip().astype(bool).to_numpy()
+    if not has_balance.all():
+        print(f"📊 Dropped {np.count_nonzero(~has_balance)} rows without a balance")
+        df = df.loc[has_balance]
+
+    # Process dates and amounts (due dates repeat a lot, cache=True parses each once)
+    df["Due Date"] = pd.to_datetime(df["Due Date"], format='%m/%d/%Y', errors="coerce", cache=True)
+    balance_raw = df["Balance"].to_numpy()  # kept for the diagnostic below, not as a column
+    df["Balance"] = pd.to_numeric(
+        [v.translate(_AMOUNT_JUNK) if isinstance(v, str) else v for v in balance_raw],
+        errors="coerce",
+    )
+    # Day-resolution subtraction on the raw datetime64 buffer; float32 keeps NaT as NaN
+    today = np.datetime64(date.today(), "D")  # one "today" for the filter and the sheet
+    delta = today - df["Due Date"].to_numpy().astype("datetime64[D]")
+    days_overdue = delta.astype("float32")
+    days_overdue[np.isnat(delta)] = np.nan
+    df["Days Overdue"] = days_overdue
+
+    # Column buffers shared by the diagnostics and the overdue mask
+    balance_arr = df["Balance"].to_numpy()
+    days_arr = df["Days Overdue"].to_numpy()
+    positive = balance_arr > 0
+
+    # Debug: Check for data conversion issues
+    print(f"📊 Rows with valid Due Date: {df['Due Date'].notna().sum()}")
+    print(f"📊 Rows with valid Balance: {df['Balance'].notna().sum()}")
+    print(f"📊 Rows with Balance > 0: {positive.sum()}")
+
+    # Check for balance conversion issues
+    balance_conversion_failed = np.isnan(balance_arr) & pd.notna(balance_raw)
+    if balance_conversion_failed.any():
+        print(f"⚠️  {np.count_nonzero(balance_conversion_failed)} rows failed balance conversion")
+        print("   Sample raw balance values:", balance_raw[balance_conversion_failed][:5].tolist())
+
+    # Filter based on minimum days overdue threshold
+    print(f"\n🔧 Processing only invoices {MINIMUM_DAYS_OVERDUE}+ days overdue")
+    m = positive & (days_arr >= MINIMUM_DAYS_OVERDUE)
+    # Only the columns aggregated below, already under their sheet names
+    overdue = pd.DataFrame({
+        "Customer": df[customer_col].to_numpy()[m],
+        "Amount": balance_arr[m],
+        "Date": df["Due Date"].to_numpy()[m],
+    })
 
-if new_rows:
-    ws.append_rows(
-        new_rows,
-        table_range=rowcol_to_a1(HEADER_ROW + 1, START_COL),
-        value_input_option="USER_ENTERED"
+    print(f"📊 Final rows to process: {len(overdue)}")
+
+    # Show distribution for debugging
+    print("\n📊 Days Overdue distribution (for Balance > 0):")
+    positive_days = days_arr[positive]
+    if len(positive_days) > 0:
+        print(f"  - Less than {MINIMUM_DAYS_OVERDUE} days: {np.count_nonzero(positive_days < MINIMUM_DAYS_OVERDUE)}")
+        print(f"  - {MINIMUM_DAYS_OVERDUE}+ days: {np.count_nonzero(positive_days >= MINIMUM_DAYS_OVERDUE)}")
+        print(f"  - Invalid/NaT dates: {np.count_nonzero(np.isnan(positive_days))}")
+
+    if len(overdue) == 0:
+        return overdue
+
+    # Clean up customer names
+    overdue["Customer"] = clean_customer(overdue["Customer"])
+
+    print(f"📊 Columns before aggregation: {list(overdue.columns)}")
+
+    # ─────────────────────────────────────────────────────────────────────────────
+    # 🔄  Aggregate multiple invoices per Customer
+    # ─────────────────────────────────────────────────────────────────────────────
+    # Date is still datetime64 here, and named aggregation keeps that dtype
+    overdue = (
+        overdue
+        .groupby("Customer", as_index=False, sort=False)
+        .agg(
+            Amount=("Amount", "sum"),
+            Date=("Date", "min"),  # oldest outstanding invoice
+        )
     )
-    print(f"➕ Added {len(new_rows)} new customers")
 
-print("✅ Sheet synchronised with latest CSV data")
+    # Recompute Days Outstanding using the oldest Date
+    # Every aggregated Date passed the overdue filter, so none of them is NaT
+    overdue["Days Outstanding"] = (today - overdue["Date"].to_numpy().astype("datetime64[D]")).astype("int64")
+
+    print(f"📊 Aggregated to unique customers: {len(overdue)} rows")
+
+    # Collections workflow buckets (21+ days only)
+    # Upper edges of 21-30, 31-45, 46-60, 61-90; anything past the last edge is 91+
+    bucket_edges = np.array([30, 45, 60, 90])
+    labels = ["21-30", "31-45", "46-60", "61-90", "91+"]
+    collection_items = [
+        "Accounting Outreach",
+        "CSM/AE Outreach",
+        "Manager Escalation",
+        "Add to No Work List",
+        "Demand Letter",
+    ]
 
-# Ensure formatting is applied
-setup_formatting_with_api(sh, ws)
\ No newline at end of file
+    # side="left" keeps the edges inclusive on the right, e.g. 30 days -> "21-30"
+    codes = np.searchsorted(bucket_edges, overdue["Days Outstanding"].to_numpy(), side="left")
+    overdue["Bucket"] = pd.Categorical.from_codes(codes, categories=labels)
+    overdue["Collection Item"] = pd.Categorical.from_codes(codes, categories=collection_items)
+
+    # Ensure all expected columns exist, in the Google Sheet's order, in one pass
+    overdue = overdue.reindex(columns=HEADERS)
+
+    # Send Date as a Sheets serial number; the column's DATE number format renders it
+    if "Date" in overdue.columns and not overdue.empty:
+        print(f"📊 Dates - sample: {overdue['Date'].head(5).dt.strftime('%Y-%m-%d').tolist()}")
+        overdue["Date"] = (
+            overdue["Date"].to_numpy().astype("datetime64[D]") - SHEETS_EPOCH
+        ).astype("int64")
+
+    return overdue
+
+def main():
+    """Sync the newest QuickBooks AR aging CSV into the overdue aging worksheet"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--force", action="store_true",
+                        help="sync even if the CSV is unchanged since the last run")
+    args = parser.parse_args()
+
+    # State from the previous successful run (worksheet id, formatting already applied)
+    try:
+        state = json.loads(STATE_FILE.read_text())
+    except (OSError, ValueError):
+        state = {}
+
+    csv_path = newest_csv()
+    if csv_path is None:
+        sys.exit("❌  No CSV found in incoming_csv/.  Aborting.")
+
+    # Same file, mtime and size as the last synced CSV, on the same day and with the
+    # same formatting: nothing to send. Days Outstanding and the buckets follow the date.
+    stat = os.stat(csv_path)
+    csv_signature = [
+        os.path.basename(csv_path), stat.st_mtime, stat.st_size,
+        date.today().isoformat(), FORMAT_VERSION,
+    ]
+    if (
+        not args.force
+        and state.get("sheet_id") == SHEET_ID
+        and state.get("csv") == csv_signature
+        and state.get("format_version") == FORMAT_VERSION
+    ):
+        print("✅ No change since last run (use --force to sync anyway)")
+        return
+
+    df = read_ar_aging_csv(csv_path)
+    overdue = clean_overdue(df)
+    if overdue.empty:
+        print("⚠️  No overdue records found. Exiting.")
+        return
+
+    sh = open_spreadsheet()
+
+    ws, worksheet_created = open_worksheet(sh)
+    header_present, formatted = sync_worksheet(sh, ws, overdue)
+
+    # A freshly written header (new or cleared worksheet, including worksheet_created)
+    # was formatted above when that batch went through. Otherwise format once per
+    # worksheet and FORMAT_VERSION, until the state file records that a previous run
+    # actually applied it.
+    state_is_warm = (
+        state.get("sheet_id") == SHEET_ID
+        and state.get("ws_id") == ws.id
+        and state.get("format_version") == FORMAT_VERSION
+    )
+    if header_present:
+        formatted = state_is_warm or setup_formatting_with_api(sh, ws)
+
+    new_state = {"sheet_id": SHEET_ID, "ws_id": ws.id, "csv": csv_signature}
+    if formatted:  # left out after a formatting error, so the next run retries it
+        new_state["format_version"] = FORMAT_VERSION
+    try:
+        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        STATE_FILE.write_text(json.dumps(new_state))
+    except OSError as e:
+        print(f"⚠️  Could not save run state: {e}")
+
+if __name__ == "__main__":
+    main()